@@ -1,8 +1,11 @@
 from __future__ import annotations
+import sqlite3
+
 from flask import Flask
 from flask_cors import CORS
 
 from config import create_dirs_if_needed
+from db import init_db
 from routes import api
 
 def create_app() -> Flask:
@@ -11,6 +14,11 @@ def create_app() -> Flask:
 
     # make sure base dirs/config exist (no-ops if already present)
     create_dirs_if_needed()
+    try:
+        init_db()
+    except sqlite3.Error:
+        # e.g. garmindb holding a write lock; indexes are an optimization, keep starting
+        app.logger.exception("init_db failed")
 
     # register API blueprint
     app.register_blueprint(api)
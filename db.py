@@ -2,157 +2,356 @@
 SQLite connection helpers and data fetchers.
 """
 from __future__ import annotations
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
-from typing import Any, Dict, List
-
-import pandas as pd
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from config import DB_PATH
 
+POOL_SIZE = 4
+
+class _PooledConnection(sqlite3.Connection):
+    generation = 0
+
+# idle connections, opened lazily so importing this module never creates the db file
+_pool: "queue.Queue[_PooledConnection]" = queue.Queue(maxsize=POOL_SIZE)
+# bumped by close_pool(); connections from an older generation are closed at checkin
+_generation = 0
+_pool_lock = threading.Lock()
+
+def _open() -> _PooledConnection:
+    # our statement set is small and fixed; a roomy cache means it is parsed once per connection
+    con = sqlite3.connect(
+        DB_PATH, check_same_thread=False, cached_statements=256, factory=_PooledConnection,
+    )
+    con.generation = _generation
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA cache_size=-20000")
+    con.execute("PRAGMA temp_store=MEMORY")
+    return con
+
 @contextmanager
-def connect():
-    con = sqlite3.connect(DB_PATH)
+def get_conn():
+    """Borrow a pooled connection; it goes back to the pool afterwards."""
+    try:
+        con = _pool.get_nowait()
+    except queue.Empty:
+        con = _open()
     try:
         yield con
     finally:
-        con.close()
+        with _pool_lock:
+            if con.generation == _generation:
+                try:
+                    _pool.put_nowait(con)
+                    con = None
+                except queue.Full:
+                    pass
+        if con is not None:
+            con.close()
+
+def close_pool() -> None:
+    """Close idle connections and retire busy ones (e.g. before the db file is removed)."""
+    global _schema_cache, _generation
+    _schema_cache = {"version": None, "tables": set(), "cols": {}, "queries": {}}
+    with _pool_lock:
+        _generation += 1
+        while True:
+            try:
+                _pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+# every fetch is ORDER BY day DESC; garmindb's tables normally have day as
+# PRIMARY KEY already, so these are only created where day has no index yet
+_DAY_INDEXES = {
+    "daily_summary": "CREATE INDEX IF NOT EXISTS ix_daily_summary_day ON daily_summary(day DESC)",
+    "sleep": "CREATE INDEX IF NOT EXISTS ix_sleep_day ON sleep(day DESC)",
+    "sleep_summary": "CREATE INDEX IF NOT EXISTS ix_sleep_summary_day ON sleep_summary(day DESC)",
+}
+
+def _day_indexed(con: sqlite3.Connection, table: str) -> bool:
+    for idx in con.execute(f'PRAGMA index_list("{table}")').fetchall():
+        first = con.execute(f'PRAGMA index_info("{idx[1]}")').fetchone()
+        if first is not None and first[2] == "day":
+            return True
+    return False
+
+def init_db() -> None:
+    """Index day where missing and refresh planner stats; no-op if the db doesn't exist yet.
+
+    Raises sqlite3.Error (e.g. if the db is locked); callers treat that as non-fatal.
+    """
+    if not DB_PATH.exists():
+        return
+    with get_conn() as con:
+        tables = _schema(con)["tables"]
+        ours = [t for t in _DAY_INDEXES if t in tables]
+        with con:
+            for table in ours:
+                if not _day_indexed(con, table):
+                    con.execute(_DAY_INDEXES[table])
+        # refresh planner stats for the tables we query; only here (startup/after a
+        # sync) since it writes sqlite_stat1 and so bumps the db mtime
+        con.execute("PRAGMA analysis_limit=400")
+        for table in ours:
+            con.execute(f'ANALYZE "{table}"')
 
-def table_exists(con: sqlite3.Connection, name: str) -> bool:
-    q = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
-    return pd.read_sql(q, con, params=(name,)).shape[0] > 0
+def db_mtime_ns() -> int:
+    """Last-modified time of the db, counting the WAL file (writes land there first).
 
-def get_columns(con: sqlite3.Connection, table: str) -> List[str]:
+    Raises FileNotFoundError if the db doesn't exist (and never creates it).
+    """
+    DB_PATH.stat()
+    # make sure a pooled connection is open first: the first one switches the db
+    # to WAL and creates the -wal file, which would otherwise change the mtime
+    # right after we read it
+    with get_conn():
+        pass
+    mtime = DB_PATH.stat().st_mtime_ns
     try:
-        return pd.read_sql(f"PRAGMA table_info({table});", con)["name"].tolist()
-    except Exception:
-        return []
+        wal = DB_PATH.with_name(DB_PATH.name + "-wal").stat()
+    except FileNotFoundError:
+        return mtime
+    # an empty -wal holds no writes; it is created by the first read and
+    # deleted when the last connection closes, so its mtime means nothing
+    return max(mtime, wal.st_mtime_ns) if wal.st_size else mtime
 
-def _to_seconds(series: pd.Series) -> pd.Series:
-    num = pd.to_numeric(series, errors="coerce")
-    if num.notna().any():
-        return num.astype(float)
-    return pd.to_timedelta(series, errors="coerce").dt.total_seconds()
+def query(con: sqlite3.Connection, q: str, params: tuple = ()) -> List[Dict[str, Any]]:
+    """Run q and return rows as plain dicts (column name -> value)."""
+    return [dict(r) for r in con.execute(q, params).fetchall()]
 
-# ------------------------ fetchers ------------------------
+# tables/columns (and the SQL built from them) as of a given PRAGMA schema_version
+_schema_cache: Dict[str, Any] = {"version": None, "tables": set(), "cols": {}, "queries": {}}
+
+def _schema(con: sqlite3.Connection) -> Dict[str, Any]:
+    """Cached schema introspection; rebuilt only when schema_version changes."""
+    global _schema_cache
+    version = con.execute("PRAGMA schema_version").fetchone()[0]
+    cache = _schema_cache  # read the global once; close_pool() may swap it concurrently
+    if version != cache["version"]:
+        tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        cols = {t: [r[1] for r in con.execute(f'PRAGMA table_info("{t}")')] for t in tables}
+        # queries are built from this same snapshot so they can never disagree with it
+        cache = {
+            "version": version, "tables": tables, "cols": cols,
+            "queries": _build_queries(tables, cols),
+        }
+        _schema_cache = cache
+    return cache
+
+def hms_to_sec(s: Any) -> Optional[float]:
+    """'HH:MM:SS[.ffffff]' (or plain seconds) -> float seconds; None if unparseable."""
+    if s is None:
+        return None
+    if isinstance(s, (int, float)):
+        return float(s)
+    try:
+        if ":" not in s:
+            return float(s)
+        h, m, sec = s.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    except (TypeError, ValueError):
+        return None
+
+# ------------------------ queries ------------------------
+
+def _ordered(select: str, where: str = "", day: str = "day") -> Tuple[str, str]:
+    """(full history, last-N-days) variants of `select`, newest first.
+
+    The windowed one bounds the index range scan by date before LIMIT and
+    takes params (date modifier, limit); see _window_params.
+    """
+    conds = [where] if where else []
+    full = select + (f" WHERE {where}" if where else "") + f" ORDER BY {day} DESC"
+    windowed = (
+        select + " WHERE " + " AND ".join(conds + [f"{day} >= date('now', ?)"])
+        + f" ORDER BY {day} DESC LIMIT ?"
+    )
+    return full, windowed
+
+def _window_params(days: int) -> Tuple[str, int]:
+    # look back twice as far as needed so gaps/NULL-filtered days still fill the limit
+    return f"-{days * 2} days", days
+
+def _run(con: sqlite3.Connection, sqls: Tuple[str, str], days: Optional[int]) -> List[Dict[str, Any]]:
+    full, windowed = sqls
+    if days is None:
+        return query(con, full)
+    return query(con, windowed, _window_params(days))
+
+_SQL_DAILY_SUMMARY_WITH_SLEEP = _ordered(
+    "SELECT ds.day AS date, ds.steps AS steps, ds.rhr AS restingHeartRate, ss.sleep_seconds AS sleepSeconds"
+    " FROM daily_summary ds LEFT JOIN sleep_summary ss ON ss.day = ds.day",
+    day="ds.day",
+)
+_SQL_DAILY_SUMMARY = _ordered(
+    "SELECT day AS date, steps AS steps, rhr AS restingHeartRate, NULL AS sleepSeconds FROM daily_summary"
+)
+_SQL_SLEEP = _ordered(
+    "SELECT day, total_sleep, deep_sleep, light_sleep, rem_sleep, awake,"
+    " avg_spo2, avg_rr, avg_stress, score, qualifier FROM sleep"
+)
+_SQL_STRESS = _ordered("SELECT day AS date, stress_avg FROM daily_summary", where="stress_avg IS NOT NULL")
 
-def fetch_daily_summary() -> List[Dict[str, Any]]:
-    with connect() as con:
-        has_sleep = table_exists(con, "sleep_summary")
-        has_sleep_seconds = "sleep_seconds" in get_columns(con, "sleep_summary") if has_sleep else False
-
-        if has_sleep and has_sleep_seconds:
-            q = """
-            SELECT ds.day AS date, ds.steps AS steps, ds.rhr AS restingHeartRate, ss.sleep_seconds AS sleepSeconds
-            FROM daily_summary ds LEFT JOIN sleep_summary ss ON ss.day = ds.day
-            ORDER BY ds.day DESC
-            """
-        else:
-            q = """
-            SELECT day AS date, steps AS steps, rhr AS restingHeartRate, NULL AS sleepSeconds
-            FROM daily_summary
-            ORDER BY day DESC
-            """
-        return pd.read_sql(q, con).to_dict(orient="records")
-
-def fetch_sleep() -> List[Dict[str, Any]]:
-    with connect() as con:
-        if not table_exists(con, "sleep"):
-            raise RuntimeError("No 'sleep' table found.")
-        q = """
-        SELECT day, total_sleep, deep_sleep, light_sleep, rem_sleep, awake,
-               avg_spo2, avg_rr, avg_stress, score, qualifier
-        FROM sleep ORDER BY day DESC
-        """
-        df = pd.read_sql(q, con)
-
-    stage_cols = ["total_sleep", "deep_sleep", "light_sleep", "rem_sleep", "awake"]
-    for col in stage_cols:
-        sec_col = f"{col}_seconds"
-        hr_col = f"{col}_hours"
-        if col in df.columns:
-            secs = _to_seconds(df[col])
-            df[sec_col] = secs.astype("Int64")
-            df[hr_col] = (secs / 3600.0).round(2)
-        else:
-            df[sec_col] = pd.Series([pd.NA] * len(df), dtype="Int64")
-            df[hr_col] = pd.Series([float('nan')] * len(df), dtype="float")
-
-    df = df.rename(columns={"day": "date"})
-    preferred = [
-        "date",
-        "total_sleep", "total_sleep_seconds", "total_sleep_hours",
-        "deep_sleep", "deep_sleep_seconds", "deep_sleep_hours",
-        "light_sleep", "light_sleep_seconds", "light_sleep_hours",
-        "rem_sleep", "rem_sleep_seconds", "rem_sleep_hours",
-        "awake", "awake_seconds", "awake_hours",
-        "avg_spo2", "avg_rr", "avg_stress", "score", "qualifier",
-    ]
-    out = [c for c in preferred if c in df.columns]
-    df = df.replace({pd.NA: None, float("nan"): None})
-    return df[out].to_dict(orient="records")
-
-def fetch_steps() -> List[Dict[str, Any]]:
-    with connect() as con:
-        if not table_exists(con, "daily_summary"):
-            raise RuntimeError("daily_summary table not found")
-        cols = set(get_columns(con, "daily_summary"))
-        if not {"day", "steps"}.issubset(cols):
-            raise RuntimeError(f"Missing columns in daily_summary: need {{'day','steps'}}, have {cols}")
-        extra = ", step_goal" if "step_goal" in cols else ", NULL AS step_goal"
-        q = f"SELECT day AS date, steps{extra} FROM daily_summary ORDER BY day DESC"
-        return pd.read_sql(q, con).to_dict(orient="records")
-
-def fetch_stress() -> List[Dict[str, Any]]:
-    with connect() as con:
-        if not table_exists(con, "daily_summary"):
-            raise RuntimeError("daily_summary table not found")
-        cols = set(get_columns(con, "daily_summary"))
-        if not {"day", "stress_avg"}.issubset(cols):
-            raise RuntimeError(f"daily_summary missing 'stress_avg' or 'day'. Columns: {cols}")
-        q = """
-        SELECT day AS date, stress_avg
-        FROM daily_summary
-        WHERE stress_avg IS NOT NULL
-        ORDER BY day DESC
-        """
-        return pd.read_sql(q, con).to_dict(orient="records")
-
-def fetch_exercise() -> List[Dict[str, Any]]:
-    with connect() as con:
-        if not table_exists(con, "daily_summary"):
-            raise RuntimeError("daily_summary table not found")
-        cols = set(get_columns(con, "daily_summary"))
-        needed = {"day", "moderate_activity_time", "vigorous_activity_time", "intensity_time_goal"}
-        if not needed.issubset(cols):
-            raise RuntimeError(f"daily_summary missing time columns: need {needed}, have {cols}")
+def _build_queries(
+    tables: Set[str], cols: Dict[str, List[str]]
+) -> Dict[str, Tuple[Optional[Tuple[str, str]], Optional[str]]]:
+    """Per-endpoint (sqls, error) for one schema snapshot.
 
+    Called once per schema_version by _schema(); column-dependent SQL (steps,
+    exercise) keeps the same string objects until the schema changes, so
+    statement caches keep hitting.
+    """
+    ds_cols = set(cols.get("daily_summary", []))
+    out: Dict[str, Tuple[Optional[Tuple[str, str]], Optional[str]]] = {}
+
+    if "daily_summary" not in tables:
+        out["daily_summary"] = (None, "daily_summary table not found")
+    elif "sleep_seconds" in cols.get("sleep_summary", []):
+        out["daily_summary"] = (_SQL_DAILY_SUMMARY_WITH_SLEEP, None)
+    else:
+        out["daily_summary"] = (_SQL_DAILY_SUMMARY, None)
+
+    if "sleep" in tables:
+        out["sleep"] = (_SQL_SLEEP, None)
+    else:
+        out["sleep"] = (None, "No 'sleep' table found.")
+
+    if "daily_summary" not in tables:
+        for name in ("steps", "stress", "exercise"):
+            out[name] = (None, "daily_summary table not found")
+        return out
+
+    if {"day", "steps"}.issubset(ds_cols):
+        extra = ", step_goal" if "step_goal" in ds_cols else ", NULL AS step_goal"
+        out["steps"] = (_ordered(f"SELECT day AS date, steps{extra} FROM daily_summary"), None)
+    else:
+        out["steps"] = (None, f"Missing columns in daily_summary: need {{'day','steps'}}, have {ds_cols}")
+
+    if {"day", "stress_avg"}.issubset(ds_cols):
+        out["stress"] = (_SQL_STRESS, None)
+    else:
+        out["stress"] = (None, f"daily_summary missing 'stress_avg' or 'day'. Columns: {ds_cols}")
+
+    needed = {"day", "moderate_activity_time", "vigorous_activity_time", "intensity_time_goal"}
+    if needed.issubset(ds_cols):
         select_bits = [
             "day AS date",
             "moderate_activity_time",
             "vigorous_activity_time",
             "intensity_time_goal",
-            "distance" if "distance" in cols else "NULL AS distance",
-            "calories_active" if "calories_active" in cols else "NULL AS calories_active",
-            "calories_total" if "calories_total" in cols else "NULL AS calories_total",
+            "distance" if "distance" in ds_cols else "NULL AS distance",
+            "calories_active" if "calories_active" in ds_cols else "NULL AS calories_active",
+            "calories_total" if "calories_total" in ds_cols else "NULL AS calories_total",
         ]
-        q = f"SELECT {', '.join(select_bits)} FROM daily_summary ORDER BY day DESC"
-        df = pd.read_sql(q, con)
+        out["exercise"] = (_ordered(f"SELECT {', '.join(select_bits)} FROM daily_summary"), None)
+    else:
+        out["exercise"] = (None, f"daily_summary missing time columns: need {needed}, have {ds_cols}")
+    return out
+
+def _sql(con: sqlite3.Connection, name: str) -> Tuple[str, str]:
+    """Prebuilt SQL pair for endpoint `name`; raises RuntimeError if the schema can't serve it."""
+    sqls, err = _schema(con)["queries"][name]
+    if err:
+        raise RuntimeError(err)
+    return sqls
+
+# ------------------------ fetchers ------------------------
+# days=None returns full history; days=N the newest N rows from the last 2N days
+
+def _daily_summary(con: sqlite3.Connection, days: Optional[int]) -> List[Dict[str, Any]]:
+    return _run(con, _sql(con, "daily_summary"), days)
+
+_SLEEP_STAGES = ("total_sleep", "deep_sleep", "light_sleep", "rem_sleep", "awake")
 
+def _sleep(con: sqlite3.Connection, days: Optional[int]) -> List[Dict[str, Any]]:
+    out = []
+    for r in _run(con, _sql(con, "sleep"), days):
+        row: Dict[str, Any] = {"date": r["day"]}
+        for col in _SLEEP_STAGES:
+            secs = hms_to_sec(r[col])
+            row[col] = r[col]
+            row[f"{col}_seconds"] = int(secs) if secs is not None else None
+            row[f"{col}_hours"] = round(secs / 3600.0, 2) if secs is not None else None
+        for col in ("avg_spo2", "avg_rr", "avg_stress", "score", "qualifier"):
+            row[col] = r[col]
+        out.append(row)
+    return out
+
+def _steps(con: sqlite3.Connection, days: Optional[int]) -> List[Dict[str, Any]]:
+    return _run(con, _sql(con, "steps"), days)
+
+def _stress(con: sqlite3.Connection, days: Optional[int]) -> List[Dict[str, Any]]:
+    return _run(con, _sql(con, "stress"), days)
+
+def _exercise(con: sqlite3.Connection, days: Optional[int]) -> List[Dict[str, Any]]:
     # seconds derived from HH:MM:SS
-    to_sec = lambda s: pd.to_timedelta(s, errors="coerce").dt.total_seconds()
-    df["moderate_activity_seconds"]   = to_sec(df["moderate_activity_time"])
-    df["vigorous_activity_seconds"]   = to_sec(df["vigorous_activity_time"])
-    df["intensity_time_goal_seconds"] = to_sec(df["intensity_time_goal"])
-    df["total_activity_seconds"] = (
-        df["moderate_activity_seconds"].fillna(0) + df["vigorous_activity_seconds"].fillna(0)
-    ).astype("Int64")
-
-    cols_out = [
-        "date",
-        "moderate_activity_time", "vigorous_activity_time", "intensity_time_goal",
-        "moderate_activity_seconds", "vigorous_activity_seconds", "intensity_time_goal_seconds",
-        "total_activity_seconds",
-        "distance", "calories_active", "calories_total",
-    ]
-    return df[cols_out].to_dict(orient="records")
+    out = []
+    for r in _run(con, _sql(con, "exercise"), days):
+        mod = hms_to_sec(r["moderate_activity_time"])
+        vig = hms_to_sec(r["vigorous_activity_time"])
+        out.append({
+            "date": r["date"],
+            "moderate_activity_time": r["moderate_activity_time"],
+            "vigorous_activity_time": r["vigorous_activity_time"],
+            "intensity_time_goal": r["intensity_time_goal"],
+            "moderate_activity_seconds": mod,
+            "vigorous_activity_seconds": vig,
+            "intensity_time_goal_seconds": hms_to_sec(r["intensity_time_goal"]),
+            "total_activity_seconds": int((mod or 0) + (vig or 0)),
+            "distance": r["distance"],
+            "calories_active": r["calories_active"],
+            "calories_total": r["calories_total"],
+        })
+    return out
+
+def fetch_daily_summary(days: Optional[int] = None) -> List[Dict[str, Any]]:
+    with get_conn() as con:
+        return _daily_summary(con, days)
+
+def fetch_sleep(days: Optional[int] = None) -> List[Dict[str, Any]]:
+    with get_conn() as con:
+        return _sleep(con, days)
+
+def fetch_steps(days: Optional[int] = None) -> List[Dict[str, Any]]:
+    with get_conn() as con:
+        return _steps(con, days)
+
+def fetch_stress(days: Optional[int] = None) -> List[Dict[str, Any]]:
+    with get_conn() as con:
+        return _stress(con, days)
+
+def fetch_exercise(days: Optional[int] = None) -> List[Dict[str, Any]]:
+    with get_conn() as con:
+        return _exercise(con, days)
+
+def fetch_dashboard(days: Optional[int] = None) -> Dict[str, Any]:
+    """All five datasets from one connection and one read transaction (consistent snapshot).
+
+    A dataset the schema can't serve comes back as None, with its message
+    under "errors", so the rest of the dashboard still loads.
+    """
+    sections = (
+        ("daily", _daily_summary), ("sleep", _sleep), ("steps", _steps),
+        ("stress", _stress), ("exercise", _exercise),
+    )
+    out: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    with get_conn() as con:
+        con.execute("BEGIN")
+        try:
+            for key, fetch in sections:
+                try:
+                    out[key] = fetch(con, days)
+                except RuntimeError as e:
+                    out[key] = None
+                    errors[key] = str(e)
+        finally:
+            con.rollback()
+    out["errors"] = errors
+    return out
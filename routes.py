@@ -2,45 +2,144 @@
 All HTTP routes (Blueprint).
 """
 from __future__ import annotations
+import functools
 import os
 import shutil
+import sqlite3
 import subprocess
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from flask import Blueprint, jsonify, request, current_app
+from typing import Dict, Optional, Tuple
+
+import orjson
+from flask import Blueprint, request, current_app, send_file
 
 from config import (
     UPDATE_LOG, DATA_ROOT, DB_PATH, CFG_PATH, CLI,
     read_cfg, write_cfg, ensure_healthdata_tree, DEFAULT_CFG,
 )
-from db import fetch_daily_summary, fetch_sleep, fetch_steps, fetch_stress, fetch_exercise
+from db import (
+    close_pool, db_mtime_ns, init_db,
+    fetch_daily_summary, fetch_sleep, fetch_steps, fetch_stress, fetch_exercise, fetch_dashboard,
+)
 
 api = Blueprint("api", __name__)
 
+# garmindb runs one at a time, off the request thread
+_update_executor = ThreadPoolExecutor(max_workers=1)
+JOBS: Dict[str, Future] = {}
+_jobs_lock = threading.Lock()
+# each finished job holds a full garmindb stdout/stderr; keep only the newest few
+MAX_JOBS = 8
+
+# (endpoint, days) -> encoded JSON body, all built at db mtime _resp_cache_mtime
+RESP_CACHE: Dict[Tuple[str, Optional[int]], bytes] = {}
+RESP_CACHE_MAX = 32
+_resp_cache_mtime: Optional[int] = None
+_resp_cache_lock = threading.Lock()
+
+_UPDATE_CMD = [CLI, "-a", "-m", "-s", "--download", "--import", "--analyze", "-l"]
+_UPDATE_ENV = {**os.environ, "HOME": str(DATA_ROOT.parent)}
+
 # ---------- tiny helpers ----------
 
+def _ojson(obj, status: int = 200):
+    """orjson-encoded JSON response (faster than jsonify, handles dates natively)."""
+    return current_app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
 def _json_error(msg: str, status: int = 500):
-    return jsonify({"error": msg}), status
+    return _ojson({"error": msg}, status)
+
+MAX_DAYS = 3650
+
+def _days_arg():
+    """Optional ?days=N (1..MAX_DAYS) limiting data endpoints to the newest N days."""
+    raw = request.args.get("days")
+    if raw is None:
+        return None
+    try:
+        days = int(raw)
+    except ValueError:
+        days = 0
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"days must be an integer between 1 and {MAX_DAYS}, got {raw!r}")
+    return days
 
 def _require_db_exists():
     if not DB_PATH.exists():
         return _json_error(f"Database not found at {DB_PATH}", 503)
     return None
 
+def _db_cached(view):
+    """Cache a read-only db endpoint on the db mtime.
+
+    Clients get an ETag (304 on a match) and the encoded body is memoized in
+    RESP_CACHE, so repeat hits skip SQLite and JSON encoding until a sync
+    changes the db. Also parses ?days once and passes it to the view.
+    """
+    name = view.__name__
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        global _resp_cache_mtime
+        try:
+            kwargs["days"] = _days_arg()
+        except ValueError as e:
+            return _json_error(str(e), 400)
+        try:
+            mtime = db_mtime_ns()
+        except FileNotFoundError:
+            return view(*args, **kwargs)
+        etag = f"{mtime:x}"
+        if request.if_none_match.contains(etag):
+            resp = current_app.response_class(status=304)
+        else:
+            key = (name, kwargs["days"])
+            with _resp_cache_lock:
+                if _resp_cache_mtime != mtime:
+                    # db changed: every cached body is stale
+                    RESP_CACHE.clear()
+                    _resp_cache_mtime = mtime
+                body = RESP_CACHE.get(key)
+            if body is not None:
+                resp = current_app.response_class(body, mimetype="application/json")
+            else:
+                resp = current_app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                with _resp_cache_lock:
+                    if _resp_cache_mtime == mtime:
+                        if len(RESP_CACHE) >= RESP_CACHE_MAX:
+                            RESP_CACHE.pop(next(iter(RESP_CACHE)))  # oldest entry
+                        RESP_CACHE[key] = resp.get_data()
+        resp.set_etag(etag)
+        # let clients cache but always revalidate, so a finished sync shows up immediately
+        resp.cache_control.no_cache = True
+        return resp
+    return wrapper
+
 def _run_garmindb():
     """Run garmindb CLI and capture logs."""
-    env = {**os.environ, "HOME": str(DATA_ROOT.parent)}
-    cmd = [CLI, "-a", "-m", "-s", "--download", "--import", "--analyze", "-l"]
-
     started = datetime.utcnow()
-    cp = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    cp = subprocess.run(_UPDATE_CMD, env=_UPDATE_ENV, capture_output=True, text=True)
     ended = datetime.utcnow()
 
     with UPDATE_LOG.open("a", encoding="utf-8") as f:
-        f.write(f"\n$ {' '.join(cmd)}\n")
+        f.write(f"\n$ {' '.join(_UPDATE_CMD)}\n")
         f.write(cp.stdout)
         f.write(cp.stderr)
         f.write(f"\nexit={cp.returncode}\n")
 
+        # first sync creates the db/tables, so index them now; failure here
+        # must not turn a good sync into a failed job
+        if cp.returncode == 0:
+            try:
+                init_db()
+            except sqlite3.Error as e:
+                f.write(f"init_db failed: {e}\n")
+
     return {
         "started_at": started.isoformat() + "Z",
         "ended_at": ended.isoformat() + "Z",
@@ -59,7 +158,7 @@ def get_config():
     cfg = read_cfg()
     if "credentials" in cfg and "password" in cfg["credentials"]:
         cfg["credentials"]["password"] = ""
-    return jsonify(cfg)
+    return _ojson(cfg)
 
 @api.post("/api/config")
 def update_config():
@@ -101,7 +200,7 @@ def update_config():
         cfg["garmin"]["domain"] = payload["garmin"]["domain"]
 
     write_cfg(cfg)
-    return jsonify({"ok": True})
+    return _ojson({"ok": True})
 
 @api.post("/api/ensure-folders")
 def ensure_folders():
@@ -111,7 +210,7 @@ def ensure_folders():
         if not CFG_PATH.exists():
             write_cfg(DEFAULT_CFG.copy())
             wrote_cfg = True
-        return jsonify({
+        return _ojson({
             "ok": True,
             "data_root": str(DATA_ROOT),
             "created_paths": created,
@@ -124,76 +223,120 @@ def ensure_folders():
 
 @api.post("/api/update")
 def update_garmin_data():
-    update_config()
-    result = _run_garmindb()
-    return jsonify(result), (200 if result["ok"] else 500)
+    with _jobs_lock:
+        # a sync is already queued/running (e.g. double-click): hand back that one
+        for jid, fut in JOBS.items():
+            if not fut.done():
+                return _ojson({"job_id": jid}, 202)
+        update_config()
+        jid = uuid.uuid4().hex
+        JOBS[jid] = _update_executor.submit(_run_garmindb)
+        # dicts keep insertion order: drop the oldest finished jobs past the cap
+        for old in list(JOBS)[:max(0, len(JOBS) - MAX_JOBS)]:
+            del JOBS[old]
+    return _ojson({"job_id": jid}, 202)
+
+@api.get("/api/update/status/<jid>")
+def update_status(jid: str):
+    with _jobs_lock:
+        fut = JOBS.get(jid)
+    if fut is None:
+        return _json_error(f"Unknown job {jid}", 404)
+    if not fut.done():
+        return _ojson({"done": False, "result": None})
+    try:
+        result = fut.result()
+    except Exception as e:
+        return _json_error(str(e))
+    return _ojson({"done": True, "result": result}, 200 if result["ok"] else 500)
 
 @api.get("/api/update/log")
 def update_log():
     if UPDATE_LOG.exists():
-        return current_app.response_class(UPDATE_LOG.read_text("utf-8"), mimetype="text/plain")
+        # streamed from disk; conditional=True gives 304s/ranges to pollers
+        return send_file(UPDATE_LOG, mimetype="text/plain", conditional=True)
     return "No log yet", 404
 
 @api.get("/api/daily-summary")
-def daily_summary():
+@_db_cached
+def daily_summary(days: Optional[int]):
     guard = _require_db_exists()
     if guard: return guard
     try:
-        return jsonify(fetch_daily_summary())
+        return _ojson(fetch_daily_summary(days))
     except Exception as e:
         return _json_error(str(e))
 
 @api.get("/api/stress")
-def stress_endpoint():
+@_db_cached
+def stress_endpoint(days: Optional[int]):
     guard = _require_db_exists()
     if guard: return guard
     try:
-        return jsonify(fetch_stress())
+        return _ojson(fetch_stress(days))
     except Exception as e:
         return _json_error(str(e))
 
 @api.get("/api/steps")
-def steps():
+@_db_cached
+def steps(days: Optional[int]):
     guard = _require_db_exists()
     if guard: return guard
     try:
-        return jsonify(fetch_steps())
+        return _ojson(fetch_steps(days))
     except Exception as e:
         return _json_error(str(e))
 
 @api.get("/api/exercise")
-def exercise():
+@_db_cached
+def exercise(days: Optional[int]):
     guard = _require_db_exists()
     if guard: return guard
     try:
-        return jsonify(fetch_exercise())
+        return _ojson(fetch_exercise(days))
     except Exception as e:
         return _json_error(str(e))
 
 @api.get("/api/sleep")
-def sleep():
+@_db_cached
+def sleep(days: Optional[int]):
     guard = _require_db_exists()
     if guard: return guard
     try:
-        return jsonify(fetch_sleep())
+        return _ojson(fetch_sleep(days))
     except Exception as e:
         return _json_error(str(e))
 
+@api.get("/api/dashboard")
+@_db_cached
+def dashboard(days: Optional[int]):
+    guard = _require_db_exists()
+    if guard: return guard
+    try:
+        return _ojson(fetch_dashboard(days))
+    except Exception as e:
+        return _json_error(str(e))
+
+# static bodies, encoded once; a fresh Response per hit since after_request
+# hooks (CORS) add headers to whatever object is returned
+_ROOT_BODY = orjson.dumps({"ok": True, "msg": "Backend running. Try /api/daily-summary"})
+
 @api.get("/")
 def root():
-    return jsonify({"ok": True, "msg": "Backend running. Try /api/daily-summary"}), 200
+    return current_app.response_class(_ROOT_BODY, mimetype="application/json")
 
 @api.get("/health")
 def health():
-    return "ok", 200
+    return current_app.response_class(b"ok", mimetype="text/plain")
 
 @api.get("/api/db-info")
 def db_info():
     p = DB_PATH
-    return jsonify({"db_path": str(p), "exists": p.exists(), "size_bytes": p.stat().st_size if p.exists() else 0})
+    return _ojson({"db_path": str(p), "exists": p.exists(), "size_bytes": p.stat().st_size if p.exists() else 0})
 
 @api.delete("/api/erase")
 def erase_data():
+    global _resp_cache_mtime
     target = DATA_ROOT
     if not target.exists():
         return _json_error(f"No HealthData folder found at {target}", 503)
@@ -202,8 +345,16 @@ def erase_data():
         return _json_error("You must pass ?confirm=true to erase all data", 400)
 
     try:
+        # pooled connections would keep the deleted db file open
+        close_pool()
+        with _resp_cache_lock:
+            # don't keep encoded copies of the erased data around
+            RESP_CACHE.clear()
+            _resp_cache_mtime = None
+        # clear the contents but keep the root itself: it may be a symlink to
+        # another disk and carries its own permissions/ownership
         for item in target.iterdir():
-            if item.is_dir(): shutil.rmtree(item)
+            if item.is_dir() and not item.is_symlink(): shutil.rmtree(item)
             else: item.unlink()
 
         garth_session = CFG_PATH.parent / "garth_session"
@@ -213,6 +364,6 @@ def erase_data():
             except Exception as e:
                 return _json_error(str(e))
 
-        return jsonify({"status": "erased_all_contents", "path_cleared": str(target)})
+        return _ojson({"status": "erased_all_contents", "path_cleared": str(target)})
     except Exception as e:
         return _json_error(str(e))